@@ -0,0 +1,46 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+# Punctuation to drop, except "$" and "%" and a "." between digits, which
+# change what a number means ("$100" vs "100", "1.5" vs "15").
+_PUNCTUATION = re.compile(r"[^\w\s$%.]|(?<!\d)\.|\.(?!\d)")
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, drop non-numeric punctuation and collapse whitespace."""
+    return " ".join(_PUNCTUATION.sub(" ", text.lower()).split())
+
+
+class QueryCache:
+    """In-process LRU cache of knowledge base results with a TTL.
+
+    Queries are matched exactly after ``normalize_query``, so re-cased,
+    re-spaced or re-punctuated repeats hit while queries that differ in any
+    word (maternity vs. paternity, 2023 vs. 2024) never share results.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, query: str) -> Optional[Any]:
+        key = normalize_query(query)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, query: str, value: Any) -> None:
+        key = normalize_query(query)
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
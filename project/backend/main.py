@@ -1,19 +1,47 @@
-import json
+import asyncio
+import hashlib
 import logging
 import os
 from datetime import datetime
+from functools import lru_cache
 from typing import Any, Optional
 
 import boto3
+import orjson
+from botocore.config import Config
+from cachetools import LRUCache
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from kb_cache import QueryCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Azercell Chatbot API", version="1.0.0")
+app = FastAPI(
+    title="Azercell Chatbot API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
+
+# Event streams must reach the client token by token; gzip would hold them
+# back until the compressor fills a block.
+STREAMING_PATHS = {"/chat/stream"}
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZip responses except those served from ``STREAMING_PATHS``."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in STREAMING_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024, compresslevel=5)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,46 +61,147 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     response: str
-    sources: Optional[list[dict[str, Any]]] = []
+    sources: Optional[list[dict[str, Any]]] = None
 
 class SearchRequest(BaseModel):
     query: str
 
+# Each distinct query is a retrieve call on the shared threadpool, so cap how
+# many a single batch request can fan out to.
+MAX_BATCH_QUERIES = 20
+
+class BatchSearchRequest(BaseModel):
+    queries: list[str] = Field(max_length=MAX_BATCH_QUERIES)
+
 AWS_CONFIG = {
     'region': os.getenv('AWS_REGION', 'us-east-1'),
     'access_key': os.getenv('AWS_ACCESS_KEY_ID', ''),
     'secret_key': os.getenv('AWS_SECRET_ACCESS_KEY', ''),
 }
 
-bedrock_client = None
-bedrock_knowledge_base = None
+# Shared by both Bedrock clients so every request reuses pooled keep-alive
+# connections instead of paying a fresh TCP/TLS handshake.
+BOTO_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=64,
+    connect_timeout=3,
+    read_timeout=60,
+    retries={'max_attempts': 2, 'mode': 'adaptive'},
+)
+
 knowledge_base_id = os.getenv('KNOWLEDGE_BASE_ID', 'JGMPKF6VEI')
+MODEL_ID = 'us.anthropic.claude-3-7-sonnet-20250219-v1:0'
+WARM_CONNECTIONS = int(os.getenv('BEDROCK_WARM_CONNECTIONS', '1'))
+
+# Everything in a retrieve call except the query text is fixed per process.
+RETRIEVE_PARAMS = {
+    "knowledgeBaseId": knowledge_base_id,
+    "retrievalConfiguration": {
+        "vectorSearchConfiguration": {
+            "numberOfResults": 3
+        }
+    }
+}
 
-def init_aws_clients():
-    global bedrock_client, bedrock_knowledge_base
-    try:
-        bedrock_client = boto3.client(
-            "bedrock-runtime",
-            region_name=AWS_CONFIG['region'],
-            aws_access_key_id=AWS_CONFIG['access_key'],
-            aws_secret_access_key=AWS_CONFIG['secret_key'],
-        )
+@lru_cache(maxsize=1)
+def aws_clients():
+    """Create the Bedrock runtime and knowledge base clients once per worker.
+
+    Nothing is created at import, so forked workers never share a connection
+    pool; the first call in each worker builds the clients and every later
+    call returns the same pair.
+    """
+    bedrock_client = boto3.client(
+        "bedrock-runtime",
+        region_name=AWS_CONFIG['region'],
+        aws_access_key_id=AWS_CONFIG['access_key'],
+        aws_secret_access_key=AWS_CONFIG['secret_key'],
+        config=BOTO_CONFIG,
+    )
+
+    bedrock_knowledge_base = boto3.client(
+        "bedrock-agent-runtime",
+        region_name=AWS_CONFIG['region'],
+        aws_access_key_id=AWS_CONFIG['access_key'],
+        aws_secret_access_key=AWS_CONFIG['secret_key'],
+        config=BOTO_CONFIG,
+    )
+    logger.info("AWS clients initialized successfully")
+    return bedrock_client, bedrock_knowledge_base
+
+def get_bedrock_client():
+    return aws_clients()[0]
+
+def get_knowledge_base_client():
+    return aws_clients()[1]
+
+kb_cache = QueryCache(
+    maxsize=int(os.getenv('KB_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('KB_CACHE_TTL', '3600')),
+)
 
-        bedrock_knowledge_base = boto3.client(
-            "bedrock-agent-runtime",
-            region_name=AWS_CONFIG['region'],
-            aws_access_key_id=AWS_CONFIG['access_key'],
-            aws_secret_access_key=AWS_CONFIG['secret_key'],
+# Exact-match cache of model replies keyed by a digest of the request body, so
+# repeated prompts (FAQ flows, testing) skip a full Claude invocation.
+chat_cache: LRUCache = LRUCache(maxsize=int(os.getenv('CHAT_CACHE_SIZE', '512')))
+
+def warm_knowledge_base():
+    """Open a pooled connection to bedrock-agent-runtime with one retrieval.
+
+    bedrock-runtime is not warmed: its only operations are billable model
+    invocations, so its first request pays the handshake instead.
+    """
+    get_knowledge_base_client().retrieve(
+        retrievalQuery={"text": "ping"},
+        **RETRIEVE_PARAMS,
+    )
+
+async def warm_bedrock_connections():
+    # Concurrent calls each check out their own connection, prefilling the
+    # pool rather than reusing a single socket.
+    results = await asyncio.gather(
+        *(run_in_threadpool(warm_knowledge_base) for _ in range(WARM_CONNECTIONS)),
+        return_exceptions=True,
+    )
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        logger.warning(
+            f"Bedrock warm-up failed for {len(failures)} of {len(results)} calls: {failures[0]!r}"
         )
-        logger.info("AWS clients initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize AWS clients: {e}")
+    else:
+        logger.info(f"Warmed {WARM_CONNECTIONS} knowledge base connections")
 
 @app.on_event("startup")
 async def startup_event():
-    init_aws_clients()
+    try:
+        aws_clients()
+    except Exception as e:
+        logger.error(f"Failed to initialize AWS clients: {e}")
+        return
+
+    if WARM_CONNECTIONS > 0:
+        # Warm up in the background so the server starts accepting traffic
+        # (and passes its healthcheck) without waiting on Bedrock. Keep a
+        # reference so the task is not garbage collected mid-flight.
+        app.state.warm_up_task = asyncio.create_task(warm_bedrock_connections())
+
+DEFAULT_MAX_TOKENS = 1024
+DEFAULT_TEMPERATURE = 0.5
+
+# Serialized once: the envelope every default request shares, minus its
+# closing brace so messages and system can be appended as raw bytes.
+_BODY_PREFIX = orjson.dumps({
+    "anthropic_version": "bedrock-2023-05-31",
+    "max_tokens": DEFAULT_MAX_TOKENS,
+    "temperature": DEFAULT_TEMPERATURE,
+})[:-1]
+
+def create_body_json(messages, max_tokens=DEFAULT_MAX_TOKENS, system=None, temperature=DEFAULT_TEMPERATURE) -> bytes:
+    if max_tokens == DEFAULT_MAX_TOKENS and temperature == DEFAULT_TEMPERATURE:
+        body = _BODY_PREFIX + b',"messages":' + orjson.dumps(messages)
+        if system:
+            body += b',"system":' + orjson.dumps(system)
+        return body + b'}'
 
-def create_body_json(messages, max_tokens=1024, system=None, temperature=0.5):
     body_dict = {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": max_tokens,
@@ -81,52 +210,120 @@ def create_body_json(messages, max_tokens=1024, system=None, temperature=0.5):
     }
     if system:
         body_dict['system'] = system
-    return json.dumps(body_dict)
-
-def get_knowledge_base_data(user_query: str) -> str:
-    """Retrieve Azercell policy and corporate information from the Bedrock Knowledge Base."""
+    return orjson.dumps(body_dict)
+
+SOURCE_SNIPPET_CHARS = 200
+
+async def fetch_knowledge_base(user_query: str) -> tuple[str, list[dict[str, Any]]]:
+    """Retrieve Azercell policy and corporate information from the Bedrock Knowledge Base.
+
+    Returns the full document text for the prompt together with a compact
+    per-document source list (snippet, score, location) for API responses.
+    Retrieval errors propagate and are never cached.
+    """
+    cached = kb_cache.get(user_query)
+    if cached is not None:
+        return cached
+
+    response = await run_in_threadpool(
+        get_knowledge_base_client().retrieve,
+        retrievalQuery={"text": user_query},
+        **RETRIEVE_PARAMS,
+    )
+    candidates = response.get("retrievalResults", [])
+
+    sources = []
+    if not candidates:
+        vec_response = "No relevant information found in the knowledge base."
+    else:
+        parts = []
+        append = parts.append
+        for ind, candidate in enumerate(candidates, 1):
+            content = candidate.get('content') or {}
+            text = content.get("text", "")
+            append(f'Document {ind}: {text}')
+            sources.append({
+                "type": "knowledge_base",
+                "text": text[:SOURCE_SNIPPET_CHARS],
+                "score": candidate.get("score"),
+                "location": candidate.get("location"),
+            })
+        vec_response = '\n\n'.join(parts)
+    result = (vec_response, sources)
+    kb_cache.set(user_query, result)
+    return result
+
+async def retrieve_knowledge_base(user_query: str) -> tuple[str, list[dict[str, Any]]]:
+    """Like ``fetch_knowledge_base``, but reports failures as prompt text.
+
+    Chat still answers from general knowledge when retrieval fails, so the
+    error is handed to the model instead of failing the request.
+    """
     try:
-        req = {
-            "knowledgeBaseId": knowledge_base_id,
-            "retrievalQuery": {"text": user_query},
-            "retrievalConfiguration": {
-                "vectorSearchConfiguration": {
-                    "numberOfResults": 3
-                }
-            }
-        }
-        response = bedrock_knowledge_base.retrieve(**req)
-        candidates = response.get("retrievalResults", [])
-
-        if not candidates:
-            return "No relevant information found in the knowledge base."
-
-        vec_response = '\n\n'.join([
-            f'Document {ind+1}: ' + i.get('content', {}).get('text', '')
-            for ind, i in enumerate(candidates)
-        ])
-        return vec_response
+        return await fetch_knowledge_base(user_query)
     except Exception as e:
         logger.error(f"Error retrieving from knowledge base: {e}")
-        return f"Error accessing knowledge base: {str(e)}"
+        return f"Error accessing knowledge base: {str(e)}", []
+
+async def get_knowledge_base_data(user_query: str) -> str:
+    """Return only the concatenated knowledge base text for a query."""
+    kb_info, _ = await retrieve_knowledge_base(user_query)
+    return kb_info
 
-def chat_with_bedrock(messages: list[dict], system: Optional[str] = None) -> str:
-    """Chat with Bedrock Claude model."""
+async def chat_with_bedrock(messages: list[dict], system: Optional[str] = None) -> str:
+    """Chat with Bedrock Claude model without blocking the event loop."""
     try:
-        model = 'us.anthropic.claude-3-7-sonnet-20250219-v1:0'
+        model = MODEL_ID
         body_json = create_body_json(messages, system=system)
 
-        response = bedrock_client.invoke_model(
+        cache_key = hashlib.blake2b(
+            model.encode() + b"\n" + body_json, digest_size=16
+        ).hexdigest()
+        cached = chat_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        response = await run_in_threadpool(
+            get_bedrock_client().invoke_model,
             modelId=model,
             body=body_json
         )
 
-        message = json.loads(response['body'].read().decode('utf-8'))
-        return message['content'][0]['text']
+        message = orjson.loads(response['body'].read())
+        text = message['content'][0]['text']
+        chat_cache[cache_key] = text
+        return text
     except Exception as e:
         logger.error(f"Error chatting with Bedrock: {e}")
         return f"Error communicating with AI model: {str(e)}"
 
+SYSTEM_PROMPT = "You are a helpful AI assistant for Azercell Telecom. You have access to company policies, procedures, and information. Always provide accurate, helpful responses based on the available information. Be professional and courteous."
+
+CHAT_INSTRUCTIONS = "Please provide a helpful response based on the knowledge base information above. If the information is not sufficient, use your general knowledge to provide a helpful response."
+STREAM_INSTRUCTIONS = "Please provide a helpful response based on the knowledge base information above."
+
+def build_enhanced_message(kb_info: str, question: str, instructions: str) -> str:
+    """Wrap the user question with the retrieved knowledge base context."""
+    return "".join((
+        "### Knowledge Base Information:\n",
+        kb_info,
+        "\n\n### User Question:\n",
+        question,
+        "\n\n",
+        instructions,
+    ))
+
+def sse_frame(payload: dict[str, Any]) -> bytes:
+    """Encode a payload as a single server-sent event."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    )
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -141,49 +338,52 @@ async def status():
 async def search_knowledge_base(request: SearchRequest):
     """Search the knowledge base for relevant information."""
     try:
-        if not bedrock_knowledge_base:
-            raise HTTPException(status_code=500, detail="Knowledge base client not initialized")
-
-        results = get_knowledge_base_data(request.query)
+        results, _ = await fetch_knowledge_base(request.query)
         return {"query": request.query, "results": results}
     except Exception as e:
         logger.error(f"Search error: {e}")
         raise HTTPException(status_code=500, detail=str(e)) from e
 
-@app.post("/chat")
+@app.post("/search/batch")
+async def batch_search_knowledge_base(request: BatchSearchRequest):
+    """Search the knowledge base for several queries concurrently."""
+    try:
+        unique_queries = list(dict.fromkeys(request.queries))
+        results = await asyncio.gather(
+            *(fetch_knowledge_base(query) for query in unique_queries)
+        )
+        by_query = {query: kb_info for query, (kb_info, _) in zip(unique_queries, results)}
+        return {"results": [
+            {"query": query, "results": by_query[query]}
+            for query in request.queries
+        ]}
+    except Exception as e:
+        logger.error(f"Batch search error: {e}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+@app.post("/chat", response_model=ChatResponse, response_model_exclude_none=True)
 async def chat_endpoint(request: ChatRequest):
     """Chat endpoint with knowledge base integration."""
     try:
-        if not bedrock_client:
-            raise HTTPException(status_code=500, detail="Bedrock client not initialized")
-
         messages = []
         if request.conversation_history:
-            messages.extend([msg.dict() for msg in request.conversation_history])
-
-        messages.append({"role": "user", "content": request.message})
+            messages.extend(
+                {"role": msg.role, "content": msg.content}
+                for msg in request.conversation_history
+            )
 
-        kb_info = get_knowledge_base_data(request.message)
+        kb_info, sources = await retrieve_knowledge_base(request.message)
 
-        enhanced_message = f"""
-        ### Knowledge Base Information:
-        {kb_info}
+        messages.append({
+            "role": "user",
+            "content": build_enhanced_message(kb_info, request.message, CHAT_INSTRUCTIONS),
+        })
 
-        ### User Question:
-        {request.message}
-
-        Please provide a helpful response based on the knowledge base information above. If the information is not sufficient, use your general knowledge to provide a helpful response.
-        """
-
-        messages[-1]["content"] = enhanced_message
-
-        system_prompt = """You are a helpful AI assistant for Azercell Telecom. You have access to company policies, procedures, and information. Always provide accurate, helpful responses based on the available information. Be professional and courteous."""
-
-        response = chat_with_bedrock(messages, system=system_prompt)
+        response = await chat_with_bedrock(messages, system=SYSTEM_PROMPT)
 
         return ChatResponse(
             response=response,
-            sources=[{"type": "knowledge_base", "content": kb_info}]
+            sources=sources or None
         )
 
     except Exception as e:
@@ -192,35 +392,32 @@ async def chat_endpoint(request: ChatRequest):
 
 @app.post("/chat/stream")
 async def chat_stream_endpoint(request: ChatRequest):
-    """Streaming chat endpoint."""
-    try:
-        if not bedrock_client:
-            raise HTTPException(status_code=500, detail="Bedrock client not initialized")
+    """Streaming chat endpoint.
 
+    Always answers with an event stream; failures before the model starts
+    streaming are reported as a single ``error`` event so clients never need a
+    second, non-streaming request.
+    """
+    try:
         messages = []
         if request.conversation_history:
-            messages.extend([msg.dict() for msg in request.conversation_history])
+            messages.extend(
+                {"role": msg.role, "content": msg.content}
+                for msg in request.conversation_history
+            )
 
-        messages.append({"role": "user", "content": request.message})
+        kb_info = await get_knowledge_base_data(request.message)
 
-        kb_info = get_knowledge_base_data(request.message)
+        messages.append({
+            "role": "user",
+            "content": build_enhanced_message(kb_info, request.message, STREAM_INSTRUCTIONS),
+        })
 
-        enhanced_message = f"""
-        ### Knowledge Base Information:
-        {kb_info}
-
-        ### User Question:
-        {request.message}
-
-        Please provide a helpful response based on the knowledge base information above.
-        """
-
-        messages[-1]["content"] = enhanced_message
-
-        model = 'us.anthropic.claude-3-7-sonnet-20250219-v1:0'
+        model = MODEL_ID
         body_json = create_body_json(messages)
 
-        stream = bedrock_client.invoke_model_with_response_stream(
+        stream = await run_in_threadpool(
+            get_bedrock_client().invoke_model_with_response_stream,
             modelId=model,
             body=body_json
         )
@@ -228,28 +425,35 @@ async def chat_stream_endpoint(request: ChatRequest):
         async def generate_stream():
             try:
                 stream_body = stream.get("body")
-                for event in stream_body:
+                # Each read from the event stream blocks on the socket, so pull
+                # events in the threadpool to keep the loop free for other clients.
+                async for event in iterate_in_threadpool(iter(stream_body)):
                     stream_chunk = event.get("chunk")
                     if stream_chunk:
-                        decoded = json.loads(stream_chunk.get("bytes").decode("utf-8"))
+                        decoded = orjson.loads(stream_chunk["bytes"])
                         delta = decoded.get("delta", {})
                         text = delta.get("text", "")
                         if text:
-                            yield f"data: {json.dumps({'text': text})}\n\n"
+                            yield sse_frame({"text": text})
             except Exception as e:
                 logger.error(f"Streaming error: {e}")
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield sse_frame({"error": str(e)})
 
-        return StreamingResponse(
-            generate_stream(),
-            media_type="text/plain",
-            headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
-        )
+        return sse_response(generate_stream())
 
     except Exception as e:
         logger.error(f"Streaming chat error: {e}")
-        raise HTTPException(status_code=500, detail=str(e)) from e
+        return sse_response(iter([sse_frame({"error": str(e)})]))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        # The KB and chat caches live in each worker process, so every extra
+        # worker starts with a cold cache of its own.
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
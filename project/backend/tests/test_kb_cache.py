@@ -0,0 +1,75 @@
+import pytest
+
+from kb_cache import QueryCache, normalize_query
+
+
+@pytest.fixture
+def cache():
+    return QueryCache(maxsize=4, ttl=60)
+
+
+def test_normalize_query():
+    assert (
+        normalize_query("  What is the  Vacation policy?! ")
+        == "what is the vacation policy"
+    )
+
+
+def test_normalize_query_keeps_number_symbols():
+    assert (
+        normalize_query("Is the $1.5 fee 10%... or not?")
+        == "is the $1.5 fee 10% or not"
+    )
+
+
+@pytest.mark.parametrize(
+    "stored, lookup",
+    [
+        ("What is the vacation policy?", "what is the vacation policy"),
+        ("What is the vacation policy?", "  WHAT is the   vacation policy !"),
+    ],
+)
+def test_normalized_repeats_hit(cache, stored, lookup):
+    cache.set(stored, "docs")
+    assert cache.get(lookup) == "docs"
+
+
+@pytest.mark.parametrize(
+    "stored, lookup",
+    [
+        (
+            "What is the maternity leave policy for employees?",
+            "What is the paternity leave policy for employees?",
+        ),
+        (
+            "How many vacation days do employees get in 2023?",
+            "How many vacation days do employees get in 2024?",
+        ),
+        ("What is the vacation policy?", "What is the vacation policy for interns?"),
+        ("Is there a $100 phone allowance?", "Is there a 100 phone allowance?"),
+        ("Do employees get a 100% bonus?", "Do employees get a 100 bonus?"),
+        ("Is the raise 1.5 percent?", "Is the raise 15 percent?"),
+    ],
+)
+def test_near_misses_do_not_hit(cache, stored, lookup):
+    cache.set(stored, "docs")
+    assert cache.get(lookup) is None
+
+
+def test_expired_entries_are_dropped(monkeypatch, cache):
+    now = 1000.0
+    monkeypatch.setattr("kb_cache.time.monotonic", lambda: now)
+    cache.set("query", "docs")
+    now += 61
+    assert cache.get("query") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
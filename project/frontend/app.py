@@ -1,8 +1,11 @@
-import json
 import os
+import time
+from collections.abc import Iterator
 from datetime import datetime
+from typing import Optional
 
-import requests
+import httpx
+import orjson
 import streamlit as st
 from dotenv import load_dotenv
 
@@ -10,6 +13,51 @@ load_dotenv()
 
 BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:8000')
 
+# Repaint the streaming reply at most this often (seconds) or once this many
+# characters have arrived, instead of on every token.
+STREAM_FLUSH_INTERVAL = 0.05
+STREAM_FLUSH_CHARS = 32
+
+@st.cache_resource
+def get_http() -> httpx.Client:
+    """Shared keep-alive client, reused across Streamlit reruns and sessions."""
+    return httpx.Client(
+        base_url=BACKEND_URL,
+        timeout=60.0,
+        limits=httpx.Limits(max_keepalive_connections=10),
+    )
+
+@st.cache_data(ttl=30, show_spinner=False)
+def backend_health_status() -> Optional[int]:
+    """Status code of the backend health check, or None if it is unreachable."""
+    try:
+        return get_http().get("/health", timeout=2).status_code
+    except httpx.HTTPError:
+        return None
+
+@st.cache_data(ttl=300, show_spinner=False)
+def search_knowledge_base(query: str) -> str:
+    """Run a knowledge base search.
+
+    The backend answers 5xx when retrieval fails, so ``raise_for_status``
+    raises and st.cache_data keeps no result for that query.
+    """
+    response = get_http().post("/search", json={"query": query})
+    response.raise_for_status()
+    return response.json().get("results", "")
+
+def iter_sse_data(response: httpx.Response) -> Iterator[bytes]:
+    """Yield the raw payload of each `data: ` line in a streamed response."""
+    buffer = b""
+    for chunk in response.iter_bytes():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.startswith(b"data: "):
+                yield line[6:]
+    if buffer.startswith(b"data: "):
+        yield buffer[6:]
+
 st.set_page_config(
     page_title="Azercell Chatbot",
     page_icon="💻",
@@ -63,14 +111,13 @@ with st.sidebar:
 
     # Backend status
     st.subheader("Backend Status")
-    try:
-        response = requests.get(f"{BACKEND_URL}/health", timeout=5)
-        if response.status_code == 200:
-            st.success("Backend Connected!")
-        else:
-            st.error("Backend Error")
-    except Exception:
+    health_status = backend_health_status()
+    if health_status == 200:
+        st.success("Backend Connected!")
+    elif health_status is None:
         st.error("Backend Unreachable")
+    else:
+        st.error("Backend Error")
 
     st.markdown("---")
 
@@ -80,16 +127,11 @@ with st.sidebar:
         if search_query:
             with st.spinner("Searching knowledge base..."):
                 try:
-                    response = requests.post(
-                        f"{BACKEND_URL}/search",
-                        json={"query": search_query}
-                    )
-                    if response.status_code == 200:
-                        results = response.json()
-                        st.success("Search completed!")
-                        st.text_area("Results:", results.get("results", ""), height=200)
-                    else:
-                        st.error(f"Search failed: {response.text}")
+                    results = search_knowledge_base(search_query)
+                    st.success("Search completed!")
+                    st.text_area("Results:", results, height=200)
+                except httpx.HTTPStatusError as e:
+                    st.error(f"Search failed: {e.response.text}")
                 except Exception as e:
                     st.error(f"Search error: {str(e)}")
 
@@ -143,68 +185,51 @@ if prompt := st.chat_input("Type your message here..."):
         message_placeholder = st.empty()
 
         try:
-            response = requests.post(
-                f"{BACKEND_URL}/chat/stream",
+            with get_http().stream(
+                "POST",
+                "/chat/stream",
                 json={
                     "message": prompt,
                     "conversation_history": conversation_history
                 },
-                stream=True
-            )
-
-            if response.status_code == 200:
-                full_response = ""
-                for line in response.iter_lines():
-                    if line:
+                headers={"Accept": "text/event-stream"},
+            ) as response:
+                if response.status_code != 200:
+                    response.read()
+                    st.error(f"Error: {response.text}")
+                else:
+                    chunks = []
+                    pending = 0
+                    last_flush = time.monotonic()
+                    for payload in iter_sse_data(response):
                         try:
-                            data = json.loads(line.decode('utf-8').replace('data: ', ''))
-                            if 'text' in data:
-                                full_response += data['text']
-                                message_placeholder.markdown(full_response + "▌")
-                            elif 'error' in data:
-                                st.error(f"Streaming error: {data['error']}")
-                                break
-                        except json.JSONDecodeError:
+                            data = orjson.loads(payload)
+                        except orjson.JSONDecodeError:
                             continue
-
-                message_placeholder.markdown(full_response)
-
-                assistant_message = {
-                    "role": "assistant",
-                    "content": full_response,
-                    "timestamp": datetime.now().strftime("%H:%M:%S")
-                }
-                st.session_state.messages.append(assistant_message)
-
-            else:
-                response = requests.post(
-                    f"{BACKEND_URL}/chat",
-                    json={
-                        "message": prompt,
-                        "conversation_history": conversation_history
-                    }
-                )
-
-                if response.status_code == 200:
-                    data = response.json()
-                    full_response = data.get("response", "No response received")
+                        if 'text' in data:
+                            chunks.append(data['text'])
+                            pending += len(data['text'])
+                            now = time.monotonic()
+                            if pending >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_INTERVAL:
+                                message_placeholder.markdown("".join(chunks) + "▌")
+                                pending = 0
+                                last_flush = now
+                        elif 'error' in data:
+                            st.error(f"Streaming error: {data['error']}")
+                            break
+
+                    full_response = "".join(chunks)
                     message_placeholder.markdown(full_response)
 
-                    assistant_message = {
-                        "role": "assistant",
-                        "content": full_response,
-                        "timestamp": datetime.now().strftime("%H:%M:%S")
-                    }
-                    st.session_state.messages.append(assistant_message)
-
-                    sources = data.get("sources", [])
-                    if sources:
-                        with st.expander("📚 Sources"):
-                            for source in sources:
-                                st.markdown(f"**{source.get('type', 'Unknown')}:**")
-                                st.text(source.get('content', ''))
-                else:
-                    st.error(f"Error: {response.text}")
+                    # An empty assistant turn would be sent back as history and
+                    # rejected by Bedrock, breaking every later request.
+                    if full_response:
+                        assistant_message = {
+                            "role": "assistant",
+                            "content": full_response,
+                            "timestamp": datetime.now().strftime("%H:%M:%S")
+                        }
+                        st.session_state.messages.append(assistant_message)
 
         except Exception as e:
             st.error(f"Error communicating with backend: {str(e)}")